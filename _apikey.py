@@ -0,0 +1,32 @@
+import functools
+import os
+import sys
+import anthropic
+
+_client = None
+_async_client = None
+
+@functools.lru_cache(maxsize=1)
+def read_api_key():
+    """Read Anthropic API key from ~/.mingdaoai/anthropic.key"""
+    key_path = os.path.expanduser("~/.mingdaoai/anthropic.key")
+    try:
+        with open(key_path) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        print(f"Error: API key file not found at {key_path}")
+        sys.exit(1)
+
+def get_client():
+    """Return the shared Anthropic client, building it on first use"""
+    global _client
+    if _client is None:
+        _client = anthropic.Anthropic(api_key=read_api_key())
+    return _client
+
+def get_async_client():
+    """Return the shared async Anthropic client, building it on first use"""
+    global _async_client
+    if _async_client is None:
+        _async_client = anthropic.AsyncAnthropic(api_key=read_api_key())
+    return _async_client
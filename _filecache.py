@@ -0,0 +1,81 @@
+import hashlib
+import os
+import pickle
+import threading
+
+FILE_CACHE_DIR = os.path.expanduser("~/.mingdaoai/filecache")
+FILE_CACHE_BUDGET = 200 * 1024 * 1024
+
+def _entry_path(file_path):
+    """Return the cache entry path for file_path, keyed by the SHA1 of its absolute path"""
+    digest = hashlib.sha1(os.path.abspath(file_path).encode()).hexdigest()
+    return os.path.join(FILE_CACHE_DIR, f"{digest}.pkl")
+
+def unique_tmp_path(path):
+    """Return a temporary path next to path that no other process or thread writes"""
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+def read_uncached(file_path):
+    """Read a whole file as bytes with a single unbuffered os.read loop"""
+    fd = os.open(file_path, os.O_RDONLY)
+    try:
+        chunks = []
+        size = os.fstat(fd).st_size
+        while True:
+            chunk = os.read(fd, max(size, 65536))
+            if not chunk:
+                break
+            chunks.append(chunk)
+    finally:
+        os.close(fd)
+    return b"".join(chunks)
+
+def read_bytes(file_path):
+    """Read a file as bytes, reusing the cached copy if its mtime and size are unchanged"""
+    st = os.stat(file_path)
+    entry_path = _entry_path(file_path)
+    try:
+        with open(entry_path, 'rb') as f:
+            entry = pickle.load(f)
+        if entry["mtime_ns"] == st.st_mtime_ns and entry["size"] == st.st_size:
+            # Touch the entry so the LRU sweep treats it as recently used
+            os.utime(entry_path)
+            return entry["data"]
+    except (OSError, pickle.UnpicklingError, EOFError, KeyError, TypeError):
+        pass
+    
+    data = read_uncached(file_path)
+    try:
+        os.makedirs(FILE_CACHE_DIR, exist_ok=True)
+        tmp_path = unique_tmp_path(entry_path)
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({"mtime_ns": st.st_mtime_ns, "size": st.st_size, "data": data}, f)
+        os.replace(tmp_path, entry_path)
+    except OSError:
+        # The cache is best effort; a failed write only costs a re-read next time
+        pass
+    return data
+
+def sweep():
+    """Trim the file cache to FILE_CACHE_BUDGET bytes"""
+    sweep_lru(FILE_CACHE_DIR, '.pkl', FILE_CACHE_BUDGET)
+
+def sweep_lru(cache_dir, suffix, budget):
+    """Delete the least recently used files ending in suffix until cache_dir fits in budget bytes"""
+    entries = []
+    try:
+        with os.scandir(cache_dir) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith(suffix):
+                    st = entry.stat()
+                    entries.append((st.st_mtime_ns, st.st_size, entry.path))
+    except FileNotFoundError:
+        return
+    total = 0
+    for _, size, path in sorted(entries, reverse=True):
+        total += size
+        if total > budget:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
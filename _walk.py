@@ -0,0 +1,35 @@
+import os
+
+# Directories never worth scanning for source or reference files; other
+# hidden directories (names starting with '.') are skipped as well
+IGNORED_DIRS = frozenset({'.git', 'node_modules', '__pycache__', '.venv', 'dist', 'build', 'target'})
+
+def is_pruned_dir(name):
+    """Return True if iter_files skips directories with this name"""
+    return name in IGNORED_DIRS or name.startswith('.')
+
+def iter_files(root, exts_tuple=None, visited=None):
+    """Recursively yield paths of regular files under root.
+
+    Only names ending with one of exts_tuple are yielded, unless it is None.
+    Symlinks are followed, with each directory visited once to avoid cycles.
+    Hidden, VCS and build output directories are pruned without being scanned.
+    """
+    if visited is None:
+        visited = set()
+    try:
+        st = os.stat(root)
+        if (st.st_dev, st.st_ino) in visited:
+            return
+        entries = os.scandir(root)
+    except OSError:
+        # Skip unreadable directories, as os.walk does by default
+        return
+    visited.add((st.st_dev, st.st_ino))
+    with entries:
+        for entry in entries:
+            if entry.is_dir():
+                if not is_pruned_dir(entry.name):
+                    yield from iter_files(entry.path, exts_tuple, visited)
+            elif entry.is_file() and (exts_tuple is None or entry.name.lower().endswith(exts_tuple)):
+                yield entry.path
@@ -1,53 +1,53 @@
 #!/usr/bin/env python3
 
 import argparse
+import hashlib
+import io
+import json
 import os
 import sys
-import anthropic
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from prompt_toolkit import PromptSession
 from prompt_toolkit.history import FileHistory
 from prompt_toolkit.shortcuts import prompt
 from prompt_toolkit.styles import Style
 from pathlib import Path
+import _filecache
+from _apikey import get_client
+from _walk import iter_files
 
-def read_api_key():
-    """Read Anthropic API key from ~/.mingdaoai/anthropic.key"""
-    key_path = os.path.expanduser("~/.mingdaoai/anthropic.key")
-    try:
-        with open(key_path) as f:
-            return f.read().strip()
-    except FileNotFoundError:
-        print(f"Error: API key file not found at {key_path}")
-        sys.exit(1)
+SESSION_CACHE_DIR = os.path.expanduser("~/.mingdaoai/codeask_cache")
+SESSION_CACHE_BUDGET = 500 * 1024 * 1024
+SUMMARY_MODEL = "claude-3-5-haiku-20241022"
+STDOUT_FLUSH_CHARS = 4096
+STDOUT_FLUSH_INTERVAL = 0.016
 
-def read_prompt_from_files(file_paths=None):
-    """Read prompts from multiple files and combine them"""
+# File extensions that typically contain source code
+CODE_EXTENSIONS = ('.py', '.js', '.java', '.cpp', '.c', '.h', '.cs', '.go', '.rs',
+                   '.swift', '.kt', '.rb', '.php', '.ts', '.scala', '.m', '.hpp')
+
+def _read_one(file_path):
+    """Read a whole file as bytes, reusing the file cache when it is unchanged"""
+    return file_path, _filecache.read_bytes(file_path)
+
+def find_source_files(file_paths=None):
+    """Discover source code files to analyze, sorted by path"""
     if file_paths is None:
         # Default to current directory if no paths provided
         file_paths = [os.getcwd()]
         print("\nNo files specified. Scanning current directory:")
         print(f"  Directory: {os.getcwd()}")
         
-    combined_prompt = ""
     files = []
     
-    # File extensions that typically contain source code
-    code_extensions = {'.py', '.js', '.java', '.cpp', '.c', '.h', '.cs', '.go', '.rs', 
-                      '.swift', '.kt', '.rb', '.php', '.ts', '.scala', '.m', '.hpp'}
-    
     # Silently discover files
     for path in file_paths:
         if os.path.isdir(path):
             # Add all code files from directory
-            for root, _, filenames in os.walk(path):
-                for filename in filenames:
-                    ext = os.path.splitext(filename)[1].lower()
-                    if ext in code_extensions:
-                        full_path = os.path.join(root, filename)
-                        files.append(full_path)
+            files.extend(iter_files(path, CODE_EXTENSIONS))
         elif os.path.isfile(path):
-            ext = os.path.splitext(path)[1].lower()
-            if ext in code_extensions:
+            if path.lower().endswith(CODE_EXTENSIONS):
                 files.append(path)
             
     if not files:
@@ -58,92 +58,245 @@ def read_prompt_from_files(file_paths=None):
     
     # Sort files for consistent display
     files.sort()
-    
-    # Only show the summary
+    return files
+
+def _relative_to(file_path, cwd):
+    """Return file_path relative to cwd, slicing instead of os.path.relpath when under it"""
+    if file_path.startswith(cwd + os.sep):
+        return file_path[len(cwd) + 1:]
+    return os.path.relpath(file_path, cwd)
+
+def print_source_summary(files):
+    """Print the list of files to analyze"""
+    cwd = os.getcwd()
     print(f"\nSummary: Found {len(files)} files to analyze:")
     for file_path in files:
-        relative_path = os.path.relpath(file_path, os.getcwd())
-        print(f"  - {relative_path}")
+        print(f"  - {_relative_to(file_path, cwd)}")
     print()
-        
-    # Silently read file contents
-    for file_path in files:
+
+def read_prompt_from_files(file_paths=None):
+    """Read prompts from multiple files and combine them"""
+    return combine_source_files(find_source_files(file_paths))
+
+def dispatch_source_reads(files, executor):
+    """Submit the reads of files to executor, then print their summary"""
+    # Queue every read before printing so the workers start while we write to the terminal
+    reads = [(file_path, executor.submit(_read_one, file_path)) for file_path in files]
+    print_source_summary(files)
+    return reads
+
+def join_source_reads(reads):
+    """Wait for dispatched reads and combine their contents, in order, into one prompt"""
+    # Accumulate raw bytes and decode the whole prompt once at the end
+    buf = bytearray()
+    for file_path, future in reads:
         try:
-            with open(file_path) as f:
-                content = f.read()
-                combined_prompt += f"\n=== From {file_path} ===\n{content}\n"
+            _, content = future.result()
         except FileNotFoundError:
             print(f"Error: File not found: {file_path}")
             sys.exit(1)
         except Exception as e:
             print(f"Error reading {file_path}: {str(e)}")
             sys.exit(1)
+        buf += f"\n=== From {file_path} ===\n".encode()
+        buf += content
+        buf += b"\n"
+    _filecache.sweep()
     
-    return combined_prompt
+    return buf.decode('utf-8', 'replace')
+
+def combine_source_files(files):
+    """Print the summary of files while reading them, and combine their contents into one prompt"""
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        return join_source_reads(dispatch_source_reads(files, executor))
+
+def _session_cache_key(model, files):
+    """Hash the model and the (path, mtime) of every file into a cache key"""
+    digest = hashlib.sha256(model.encode())
+    stamps = sorted((os.path.abspath(p), os.stat(p).st_mtime_ns) for p in files)
+    for path, mtime_ns in stamps:
+        digest.update(f"\0{path}\0{mtime_ns}".encode())
+    return digest.hexdigest()
+
+def _load_session(cache_path):
+    """Load a saved session, or return None if there is no usable one"""
+    try:
+        with open(cache_path) as f:
+            session = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if not (isinstance(session, dict)
+            and isinstance(session.get("messages"), list)
+            and isinstance(session.get("prefix_len"), int)
+            and 0 <= session["prefix_len"] <= len(session["messages"])):
+        return None
+    # Touch the file so the LRU sweep treats it as recently used
+    os.utime(cache_path)
+    return session
+
+def _save_session(cache_path, session):
+    """Atomically write a session to disk and sweep old sessions"""
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = _filecache.unique_tmp_path(cache_path)
+    with open(tmp_path, 'w') as f:
+        json.dump(session, f)
+    os.replace(tmp_path, cache_path)
+    _filecache.sweep_lru(os.path.dirname(cache_path), '.json', SESSION_CACHE_BUDGET)
+
+def _print_stream(stream):
+    """Echo streamed text deltas to stdout in batches and return the full text"""
+    # Flushing every delta costs a write syscall per token; batch them until
+    # the buffer fills, and let a background thread flush whatever is pending
+    # every interval so text never waits on the next delta to appear
+    parts = []
+    pending = io.StringIO()
+    lock = threading.Lock()
+    done = threading.Event()
+
+    def flush_pending():
+        nonlocal pending
+        if pending.tell():
+            sys.stdout.write(pending.getvalue())
+            sys.stdout.flush()
+            pending = io.StringIO()
+
+    def flush_periodically():
+        while not done.wait(STDOUT_FLUSH_INTERVAL):
+            with lock:
+                flush_pending()
+
+    flusher = threading.Thread(target=flush_periodically, daemon=True)
+    flusher.start()
+    try:
+        for chunk in stream:
+            if chunk.type == "content_block_delta":
+                parts.append(chunk.delta.text)
+                with lock:
+                    pending.write(chunk.delta.text)
+                    if pending.tell() >= STDOUT_FLUSH_CHARS:
+                        flush_pending()
+    finally:
+        done.set()
+        flusher.join()
+        flush_pending()
+    return "".join(parts)
 
 class ChatSession:
-    def __init__(self, files=None, model="claude-3-5-sonnet-20241022", context_window=5):
+    def __init__(self, files=None, model="claude-3-5-sonnet-20241022", context_window=5, new_session=False):
         self.model = model
-        self.client = anthropic.Anthropic(api_key=read_api_key())
-        # Always read files, using None to trigger current directory scan
-        self.context = read_prompt_from_files(files)
         self.context_window = context_window
-        self.conversation_history = []
+        self.system = "You are a helpful programming assistant."
+        
+        # Always discover files, using None to trigger current directory scan
+        source_files = find_source_files(files)
+        cache_key = _session_cache_key(model, source_files)
+        self.cache_path = os.path.join(SESSION_CACHE_DIR, f"{cache_key}.json")
         
-        self.messages = [
-            {"role": "assistant", "content": "You are a helpful programming assistant."}
-        ]
+        # Resume a saved conversation over the same files without re-reading them
+        session = None if new_session else _load_session(self.cache_path)
+        if session is not None:
+            self.messages = session["messages"]
+            self.prefix_len = session["prefix_len"]
+            self._pending_reads = None
+            print_source_summary(source_files)
+            print(f"Resumed cached session ({len(self.messages) - self.prefix_len} earlier messages, use --new-session to start over)")
+        else:
+            # Read files in the background while the client is built; the
+            # reads are only waited for when the first chat() needs them
+            executor = ThreadPoolExecutor(max_workers=16)
+            self._pending_reads = dispatch_source_reads(source_files, executor)
+            executor.shutdown(wait=False)
+            self.messages = []
+            self.prefix_len = 0
         
-        if self.context:
+        self.client = get_client()
+
+    def _ensure_context(self):
+        """Wait for the background file reads and add the code context to messages"""
+        if self._pending_reads is None:
+            return
+        context = join_source_reads(self._pending_reads)
+        self._pending_reads = None
+        
+        if context:
+            # Mark the code context as a prompt-cache breakpoint so later turns
+            # reuse its prefill; never mutate this block, only append after it
             self.messages.append({
                 "role": "user", 
-                "content": f"Here is the code context I'll be asking about:\n{self.context}"
+                "content": [{
+                    "type": "text",
+                    "text": f"Here is the code context I'll be asking about:\n{context}",
+                    "cache_control": {"type": "ephemeral"}
+                }]
             })
             self.messages.append({
                 "role": "assistant", 
                 "content": "I understand. I'll help answer questions about this code. What would you like to know?"
             })
 
-    def _format_conversation_context(self):
-        """Format recent conversation history for context"""
-        if not self.conversation_history:
-            return ""
-            
-        context = "\nRecent conversation history:\n"
-        # Take the last n conversations from history
-        recent = self.conversation_history[-self.context_window:]
-        for i, (q, a) in enumerate(recent, 1):
-            context += f"\nQ{i}: {q}\nA{i}: {a}\n"
-        return context
+        # Messages before this index form the cached context prefix
+        self.prefix_len = len(self.messages)
+
+    def _compact_history(self):
+        """Summarize the oldest Q&A pairs once the history grows past twice the window"""
+        history = self.messages[self.prefix_len:]
+        # Q&A turns always start with a user message; a leading assistant
+        # message is the summary from an earlier compaction
+        turns = len(history) - (1 if history and history[0]["role"] == "assistant" else 0)
+        if turns <= 4 * self.context_window:
+            return
+        # Compact back to the window in one go so the cached prefix is
+        # invalidated once every context_window turns rather than every turn.
+        # An earlier summary turn is among the oldest messages and gets folded in.
+        split = len(history) - 2 * self.context_window
+        old, recent = history[:split], history[split:]
+        try:
+            summary = self._summarize(old)
+            compacted = [{"role": "assistant", "content": f"[Earlier conversation summary]: {summary}"}]
+        except Exception as e:
+            print(f"\nWarning: could not summarize earlier conversation, dropping it: {str(e)}")
+            compacted = []
+        self.messages[self.prefix_len:] = compacted + recent
+
+    def _summarize(self, messages):
+        """Summarize a run of conversation messages with a cheaper model"""
+        transcript = "\n\n".join(
+            f"{message['role'].capitalize()}: {message['content']}" for message in messages
+        )
+        response = self.client.messages.create(
+            model=SUMMARY_MODEL,
+            max_tokens=1024,
+            system="Summarize this conversation about a codebase. Keep the questions asked, the conclusions reached and any code details needed to follow up on them.",
+            messages=[{"role": "user", "content": transcript}]
+        )
+        return response.content[0].text
 
     def chat(self, user_input):
         """Process a single chat message and stream the response"""
         try:
-            # Add conversation context to the user's question
-            conversation_context = self._format_conversation_context()
-            enhanced_input = user_input
-            if conversation_context:
-                enhanced_input = f"{conversation_context}\nCurrent question: {user_input}"
-            
-            self.messages.append({"role": "user", "content": enhanced_input})
+            # History lives in self.messages; append only the new question so
+            # the previous turn's messages stay a bit-identical prefix
+            self._ensure_context()
+            self._compact_history()
+            self.messages.append({"role": "user", "content": user_input})
             
             # Stream the response
             print("\nClaude:", end=" ", flush=True)
-            full_response = ""
             with self.client.messages.stream(
                 model=self.model,
                 max_tokens=4096,
+                system=self.system,
                 messages=self.messages
             ) as stream:
-                for chunk in stream:
-                    if chunk.type == "content_block_delta":
-                        print(chunk.delta.text, end="", flush=True)
-                        full_response += chunk.delta.text
+                full_response = _print_stream(stream)
             
             print("\n")  # Add newline after streaming completes
             
             self.messages.append({"role": "assistant", "content": full_response})
-            self.conversation_history.append((user_input, full_response))
+            _save_session(self.cache_path, {
+                "prefix_len": self.prefix_len,
+                "messages": self.messages
+            })
             
             return full_response
             
@@ -156,12 +309,15 @@ def start_chat_interface():
     parser.add_argument("--files", nargs="+", required=False, 
                        help="Paths to files or directories containing the code to analyze")
     parser.add_argument("--context-window", type=int, default=10,
-                       help="Number of previous Q&A pairs to include in context (default: 10)")
+                       help="Number of recent Q&A pairs always kept in context (default: 10)")
+    parser.add_argument("--new-session", action="store_true",
+                       help="Start a fresh conversation instead of resuming the cached one")
     
     args = parser.parse_args()
     
     print("\nStarting code analysis with Claude...")
-    chat_session = ChatSession(files=args.files, context_window=args.context_window)
+    chat_session = ChatSession(files=args.files, context_window=args.context_window,
+                               new_session=args.new_session)
     
     # Initialize prompt session with file history
     history_file = Path.home() / '.mingdaoai' / 'claude_chat_history'
@@ -1,128 +1,370 @@
 #!/usr/bin/env python3
 
 import argparse
+import asyncio
+import hashlib
 import json
 import os
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-import anthropic
+import _filecache
+from _apikey import get_async_client
+from _walk import is_pruned_dir, iter_files
 
-def read_api_key():
-    """Read Anthropic API key from ~/.mingdaoai/anthropic.key"""
-    key_path = os.path.expanduser("~/.mingdaoai/anthropic.key")
-    try:
-        with open(key_path) as f:
-            return f.read().strip()
-    except FileNotFoundError:
-        print(f"Error: API key file not found at {key_path}")
-        sys.exit(1)
+# Bounds for the per-file max_tokens budget; MAX_FILE_TOKENS also caps the
+# total output across continuations of a truncated file
+MIN_FILE_TOKENS = 2048
+MAX_FILE_TOKENS = 4096*2
+
+# Streamed output is handed to a worker thread, keeping disk I/O off the
+# event loop, once this many characters are pending or this many seconds
+# have passed since the last write
+WRITE_CHUNK_CHARS = 4096
+WRITE_INTERVAL = 0.1
+
+GENERATION_INSTRUCTIONS = "Generate the code for this file. Output only the code content, without any formatting or JSON."
 
 def read_prompt_from_text(text):
     """Read prompt directly from text input"""
     return text
 
+def _read_one(file_path):
+    """Read a whole file as text, reusing the file cache when it is unchanged"""
+    return file_path, _filecache.read_bytes(file_path).decode('utf-8', 'replace')
+
+def _reached_by_walk(path, root):
+    """Return True if walking root with iter_files would cover path.
+
+    Both paths must be canonical. A path under root is only covered when
+    none of the directories between them is pruned by the walk.
+    """
+    if path == root:
+        return True
+    if not path.startswith(root.rstrip(os.sep) + os.sep):
+        return False
+    parts = os.path.relpath(path, root).split(os.sep)
+    # Files are yielded whatever their name; only directories are pruned
+    dirs = parts if os.path.isdir(path) else parts[:-1]
+    return not any(is_pruned_dir(d) for d in dirs)
+
+def _drop_nested_paths(input_paths):
+    """Drop input paths that repeat, or sit inside, another input path the walk reaches"""
+    # Shorter canonical paths are kept first so any ancestor is seen before
+    # its descendants; the survivors keep their original order
+    # Only existing files and directories may act as ancestors; an empty
+    # entry would otherwise canonicalize to cwd and swallow every input
+    input_paths = [p for p in input_paths if p and os.path.exists(p)]
+    kept = []
+    for real in sorted({os.path.realpath(p) for p in input_paths}, key=len):
+        if not any(_reached_by_walk(real, q) for q in kept):
+            kept.append(real)
+    kept = set(kept)
+    
+    result = []
+    for path in input_paths:
+        real = os.path.realpath(path)
+        if real in kept:
+            kept.discard(real)
+            result.append(path)
+    return result
+
 def read_input_files(input_paths):
     """Read content of input files and directories"""
-    file_contents = []
-    for path in input_paths:
+    # Collect every path first, then fan the reads out to a thread pool.
+    # Inputs are deduplicated so no file is read or sent twice.
+    file_paths = []
+    seen = set()
+    for path in _drop_nested_paths(input_paths):
         if os.path.isfile(path):
-            with open(path) as f:
-                file_contents.append({
-                    'path': path,
-                    'content': f.read()
-                })
+            candidates = [path]
         elif os.path.isdir(path):
-            for root, _, files in os.walk(path):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    with open(file_path) as f:
-                        file_contents.append({
-                            'path': file_path,
-                            'content': f.read()
-                        })
+            candidates = iter_files(path)
+        else:
+            continue
+        for file_path in candidates:
+            real = os.path.realpath(file_path)
+            if real not in seen:
+                seen.add(real)
+                file_paths.append(file_path)
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        file_contents = [
+            {'path': file_path, 'content': content}
+            for file_path, content in executor.map(_read_one, file_paths)
+        ]
+    _filecache.sweep()
     return file_contents
 
-def generate_code(prompt, output_dir, input_paths=None, model="claude-3-5-sonnet-20241022"):
+class _JsonArrayItems:
+    """Incrementally parse the elements of the first JSON array in streamed text.
+
+    Text before the opening '[' (and after the closing ']') is skipped, so
+    prose or code fences around the array do not break parsing. A '[' only
+    opens the array when the next non-whitespace character is '{' or ']',
+    so bracketed prose such as "Files [see below]:" is skipped too.
+    """
+
+    def __init__(self):
+        self.started = False
+        self.finished = False
+        self._candidate = False
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._item = []
+
+    def feed(self, text):
+        """Consume a chunk of text and return the elements completed by it"""
+        items = []
+        for ch in text:
+            if self.finished:
+                break
+            if not self.started:
+                if self._candidate and ch in '{]':
+                    self.started = True
+                    self._depth = 1
+                elif self._candidate and ch.isspace():
+                    continue
+                else:
+                    self._candidate = ch == '['
+                    continue
+            if self._depth > 1:
+                self._item.append(ch)
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == '\\':
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in '[{':
+                if self._depth == 1:
+                    self._item = [ch]
+                self._depth += 1
+            elif ch in ']}':
+                self._depth -= 1
+                if self._depth == 1:
+                    items.append(json.loads("".join(self._item)))
+                    self._item = []
+                elif self._depth == 0:
+                    self.finished = True
+        return items
+
+def _json_member(key, encoded_value):
+    """Format a JSON object member from a key and an already-encoded value"""
+    return f"{json.dumps(key)}: {encoded_value}"
+
+def _json_object(members):
+    """Assemble a JSON object from already-encoded members"""
+    return "{" + ", ".join(members) + "}"
+
+def _estimate_max_tokens(description):
+    """Size the per-file token budget from the length of its description"""
+    return max(MIN_FILE_TOKENS, min(len(description.split()) * 60, MAX_FILE_TOKENS))
+
+def _open_output(full_path, mode='w'):
+    """Open full_path for writing, creating parent directories"""
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    return open(full_path, mode, encoding='utf-8')
+
+def _write_through(out, text):
+    """Write text to out and flush it so it reaches the file immediately"""
+    out.write(text)
+    out.flush()
+
+def _prepare_continuation(full_path):
+    """Return the truncated output in full_path as an assistant prefill.
+
+    The API rejects a prefill ending in whitespace, so trailing whitespace
+    is stripped from both the prefill and the file before appending to it.
+    """
+    prefill = _filecache.read_uncached(full_path).decode('utf-8', 'replace').rstrip()
+    os.truncate(full_path, len(prefill.encode('utf-8')))
+    return prefill
+
+async def generate_code(prompt, output_dir, input_paths=None, model="claude-3-5-sonnet-20241022"):
     """Generate code snippets using Claude API and save directly to files"""
-    api_key = read_api_key()
     os.makedirs(output_dir, exist_ok=True)
     
     # Read input files if provided
-    input_context = ""
+    parts = []
     if input_paths:
         file_contents = read_input_files(input_paths)
         for file in file_contents:
-            input_context += f"\n=== {file['path']} ===\n"
-            input_context += file['content'] + "\n"
+            parts.append(f"\n=== {file['path']} ===\n")
+            parts.append(file['content'])
+            parts.append("\n")
+    input_context = "".join(parts)
     
     try:
-        client = anthropic.Anthropic(api_key=api_key)
+        client = get_async_client()
+        
+        # The reference files are repeated in every request, so send them as a
+        # prompt-cache block that each call can reuse
+        reference_blocks = []
+        if input_context:
+            reference_blocks.append({
+                "type": "text",
+                "text": f"Reference files:\n{input_context}",
+                "cache_control": {"type": "ephemeral"}
+            })
         
         # First ask for list of files with descriptions
         file_list_prompt = prompt
         if input_context:
-            file_list_prompt = f"Reference files:\n{input_context}\n\nBased on these files and the request:\n{prompt}"
+            file_list_prompt = f"Based on these files and the request:\n{prompt}"
             
-        response = client.messages.create(
-            model=model,
-            max_tokens=4096,
-            messages=[
-                {"role": "assistant", "content": "You are a helpful programming assistant. Based on the user's request, return a JSON array where each element has 'filepath' and 'description' fields, describing what each file will contain. Output the answer only with json array format. Do not include any other text in front of or behind the json array.\n"},
-                {"role": "user", "content": file_list_prompt}
+        # Each file is told about the plan so far (paths and descriptions)
+        # rather than the contents of files generated before it, so the
+        # requests are independent and can run concurrently. Plan entries and
+        # included files are JSON-encoded once as "key": value fragments and
+        # reused by every prompt that carries them.
+        plan_members = []
+        included_members = {}
+        semaphore = asyncio.Semaphore(8)
+        
+        # Resolved with the SHA1 of each file's content once it is written
+        # (or None if it failed), for files that include it
+        loop = asyncio.get_running_loop()
+        generated = {}
+        
+        async def stream_to_file(full_path, generation_prompt, max_tokens, prefill=""):
+            """Stream one file's code straight to disk after prefill, returning its SHA1 and the stop reason"""
+            sha1 = hashlib.sha1(prefill.encode())
+            messages = [
+                {"role": "user", "content": reference_blocks + [{"type": "text", "text": prompt + "\n\n" + generation_prompt}]}
             ]
-        )
-        file_specs = json.loads(response.content[0].text)
+            if prefill:
+                # Continue a truncated file from where it stopped
+                messages.append({"role": "assistant", "content": prefill})
+            mode = 'a' if prefill else 'w'
+            out = None
+            pending = []
+            pending_len = 0
+            last_write = time.monotonic()
+            try:
+                async with semaphore:
+                    async with client.messages.stream(
+                        model=model,
+                        max_tokens=max_tokens,
+                        system="You are a helpful programming assistant.",
+                        messages=messages
+                    ) as stream:
+                        async for event in stream:
+                            if event.type == "content_block_delta":
+                                sha1.update(event.delta.text.encode())
+                                pending.append(event.delta.text)
+                                pending_len += len(event.delta.text)
+                                now = time.monotonic()
+                                if pending_len >= WRITE_CHUNK_CHARS or now - last_write >= WRITE_INTERVAL:
+                                    if out is None:
+                                        out = await asyncio.to_thread(_open_output, full_path, mode)
+                                    await asyncio.to_thread(_write_through, out, "".join(pending))
+                                    pending = []
+                                    pending_len = 0
+                                    last_write = now
+                        message = await stream.get_final_message()
+                if out is None:
+                    out = await asyncio.to_thread(_open_output, full_path, mode)
+                await asyncio.to_thread(out.write, "".join(pending))
+            finally:
+                if out is not None:
+                    await asyncio.to_thread(out.close)
+            return sha1.hexdigest(), message.stop_reason
         
-        # Generate and save code for each file
-        generated_files = {}
+        async def encode_included(dep, dep_sha1):
+            """Read a generated dependency back from disk and encode it as a JSON member"""
+            dep_data = await asyncio.to_thread(_filecache.read_uncached, os.path.join(output_dir, dep))
+            return _json_member(dep, json.dumps({"sha1": dep_sha1, "content": dep_data.decode('utf-8', 'replace')}))
         
-        for file_spec in file_specs:
+        async def generate_one(file_spec, plan, earlier):
             filepath = file_spec['filepath']
             description = file_spec['description']
-            
-            # Include previously generated files and input files in context
-            generation_prompt = json.dumps({
-                "file_info": {
-                    "filepath": filepath,
-                    "purpose": description
-                },
-                "context": {
-                    "reference_files": input_context,
-                    "generated_files": generated_files
-                },
-                "instructions": "Generate the code for this file. Output only the code content, without any formatting or JSON."
-            }, indent=2)
-            
-            file_response = client.messages.create(
-                model=model,
-                max_tokens=4096*2,
-                messages=[
-                    {"role": "assistant", "content": "You are a helpful programming assistant."},
-                    {"role": "user", "content": prompt + "\n\n" + generation_prompt}
-                ]
-            )
-            
-            code = file_response.content[0].text
-            print(f"Generated code for {filepath} ({description}):")
-            print(code)
-            print("\n========")
-            
-            # Save the code to file
             full_path = os.path.join(output_dir, filepath)
-            os.makedirs(os.path.dirname(full_path), exist_ok=True)
-            try:
-                with open(full_path, 'w') as f:
-                    f.write(code)
-                print(f"Created: {full_path}")
-            except Exception as e:
-                print(f"Error creating {full_path}: {str(e)}")
-                continue
+            digest = None
             
-            # Add to generated files context as JSON
-            generated_files[filepath] = {
-                "description": description,
-                "content": code
-            }
+            try:
+                # Only files earlier in the plan may be included, which rules out cycles
+                included = []
+                includes = file_spec.get('include')
+                if not (isinstance(includes, list) and all(isinstance(dep, str) for dep in includes)):
+                    # The field comes from model output; ignore it unless it is a list of paths
+                    includes = []
+                for dep in includes:
+                    if dep not in earlier:
+                        continue
+                    dep_sha1 = await generated[dep]
+                    if dep_sha1 is None:
+                        continue
+                    if dep not in included_members:
+                        included_members[dep] = asyncio.ensure_future(encode_included(dep, dep_sha1))
+                    included.append(await included_members[dep])
+                
+                generation_prompt = _json_object([
+                    _json_member("file_info", json.dumps({"filepath": filepath, "purpose": description})),
+                    _json_member("planned_files", _json_object(plan)),
+                    _json_member("included_files", _json_object(included)),
+                    _json_member("instructions", json.dumps(GENERATION_INSTRUCTIONS))
+                ])
+                
+                # Start with a token budget sized to the description; when the
+                # output is cut off, continue it from the truncated text rather
+                # than regenerating, until MAX_FILE_TOKENS have been spent
+                max_tokens = _estimate_max_tokens(description)
+                try:
+                    file_digest, stop_reason = await stream_to_file(full_path, generation_prompt, max_tokens)
+                    spent = max_tokens
+                    while stop_reason == "max_tokens" and spent < MAX_FILE_TOKENS:
+                        max_tokens = min(2 * max_tokens, MAX_FILE_TOKENS - spent)
+                        spent += max_tokens
+                        print(f"Output for {filepath} hit the token limit, continuing with max_tokens={max_tokens}")
+                        prefill = await asyncio.to_thread(_prepare_continuation, full_path)
+                        file_digest, stop_reason = await stream_to_file(full_path, generation_prompt, max_tokens, prefill)
+                    digest = file_digest
+                    if stop_reason == "max_tokens":
+                        print(f"Warning: {full_path} was truncated at {MAX_FILE_TOKENS} tokens ({description})")
+                    else:
+                        print(f"Created: {full_path} ({description})")
+                except OSError as e:
+                    print(f"Error creating {full_path}: {str(e)}")
+            finally:
+                if not generated[filepath].done():
+                    generated[filepath].set_result(digest)
+        
+        # Stream the file list and start generating each file as soon as its
+        # spec has been parsed, instead of waiting for the whole array
+        tasks = []
+        items = _JsonArrayItems()
+        async with client.messages.stream(
+            model=model,
+            max_tokens=4096,
+            system="You are a helpful programming assistant. Based on the user's request, return a JSON array where each element has 'filepath' and 'description' fields, describing what each file will contain. If writing a file requires the full content of files listed earlier in the array, add an 'include' field with their filepaths. Output the answer only with json array format. Do not include any other text in front of or behind the json array.\n",
+            messages=[
+                {"role": "user", "content": reference_blocks + [{"type": "text", "text": file_list_prompt}]}
+            ]
+        ) as stream:
+            async for text in stream.text_stream:
+                for file_spec in items.feed(text):
+                    if not (isinstance(file_spec, dict) and isinstance(file_spec.get('filepath'), str)
+                            and isinstance(file_spec.get('description'), str)):
+                        print(f"Skipping malformed file spec: {json.dumps(file_spec)}")
+                        continue
+                    if file_spec['filepath'] in generated:
+                        # Two concurrent tasks would stream into the same file
+                        print(f"Skipping duplicate file spec for {file_spec['filepath']}")
+                        continue
+                    earlier = set(generated)
+                    plan_members.append(_json_member(file_spec['filepath'], json.dumps(file_spec['description'])))
+                    generated[file_spec['filepath']] = loop.create_future()
+                    tasks.append(asyncio.create_task(generate_one(file_spec, list(plan_members), earlier)))
+        
+        if not tasks:
+            raise ValueError("No file specs found in the file list response")
+        await asyncio.gather(*tasks)
             
     except Exception as e:
         print(f"Error generating code: {str(e)}")
@@ -145,7 +387,7 @@ def main():
         input_paths = [p.strip() for p in args.input.split(',')]
     
     prompt = read_prompt_from_text(args.text_prompt)
-    generate_code(prompt, args.output, input_paths)
+    asyncio.run(generate_code(prompt, args.output, input_paths))
 
 if __name__ == "__main__":
     main()